@@ -1,12 +1,24 @@
 import os
+import json
+import hashlib
+import atexit
 import logging
-import time
+import signal
 import threading
-from typing import Dict, List
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Sequence, Tuple
 
 import gkeepapi
 import schedule
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from waitress import serve
+
+try:
+    import orjson
+except ImportError:  # optional, faster serializer
+    orjson = None
 
 def env(name: str, default: str | None = None) -> str | None:
     val = os.getenv(name)
@@ -17,6 +29,26 @@ def parse_sync_list_names(raw: str | None) -> List[str]:
         return []
     return [name.strip() for name in raw.split(",") if name.strip()]
 
+@dataclass(frozen=True)
+class Config:
+    """Environment settings, read once at startup."""
+    gkeep_email: str | None
+    gkeep_password: str | None
+    gkeep_master_token: str | None
+    sync_list_names: Tuple[str, ...]
+    state_path: str
+    server_port: int
+
+def load_config() -> Config:
+    return Config(
+        gkeep_email=env("GKEEP_EMAIL"),
+        gkeep_password=env("GKEEP_PASSWORD"),
+        gkeep_master_token=env("GKEEP_MASTER_TOKEN"),
+        sync_list_names=tuple(parse_sync_list_names(env("SYNC_LIST_NAMES"))),
+        state_path=env("GKEEP_STATE_PATH", "/data/keep_state.json") or "/data/keep_state.json",
+        server_port=int(env("SERVER_PORT", "5000") or "5000"),
+    )
+
 def setup_logging() -> None:
     level = env("LOG_LEVEL", "INFO") or "INFO"
     logging.basicConfig(
@@ -24,51 +56,176 @@ def setup_logging() -> None:
         format="%(asctime)s [%(levelname)s] %(message)s",
     )
 
-def login_keep(email: str, password: str | None) -> gkeepapi.Keep | None:
+def load_keep_state(path: str) -> dict | None:
+    """Load a previously dumped gkeepapi state, if one exists and is readable."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable Google Keep state cache '{path}': {e}")
+        return None
+
+def save_keep_state(keep: gkeepapi.Keep, path: str) -> None:
+    """Atomically persist the gkeepapi state so the next start only syncs deltas."""
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        # The cache holds the full text of every note; keep it owner-only.
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)  # in case a stale .tmp already existed with wider permissions
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(keep.dump(), fh)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.exception(f"Failed to save Google Keep state cache '{path}': {e}")
+
+def discard_keep_state(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f"Failed to remove Google Keep state cache '{path}': {e}")
+
+def authenticate_keep(cfg: Config, secret: str, state: dict | None) -> gkeepapi.Keep:
     keep = gkeepapi.Keep()
-    master_token = env("GKEEP_MASTER_TOKEN")
+    keep.authenticate(cfg.gkeep_email, secret, state=state, sync=False)
+    keep.sync()
+    return keep
+
+def login_keep(cfg: Config) -> gkeepapi.Keep | None:
+    secret = cfg.gkeep_master_token or cfg.gkeep_password
+    if not secret:
+        logging.error("GKEEP_PASSWORD or GKEEP_MASTER_TOKEN must be provided.")
+        return None
 
     try:
-        if master_token:
-            keep.authenticate(email, master_token)
-        else:
-            if not password:
-                logging.error("GKEEP_PASSWORD or GKEEP_MASTER_TOKEN must be provided.")
-                return None
-            keep.authenticate(email, password)
-
-        keep.sync()
-        return keep
+        state = load_keep_state(cfg.state_path)
+        if state is not None:
+            try:
+                keep = authenticate_keep(cfg, secret, state)
+                logging.info("Restored Google Keep state cache; synced changes only.")
+                return keep
+            except gkeepapi.exception.LoginException:
+                raise
+            except Exception as e:
+                # Malformed cache or server-requested full resync: drop the cache and start fresh.
+                logging.warning(f"Discarding Google Keep state cache '{cfg.state_path}': {e}")
+                discard_keep_state(cfg.state_path)
+
+        return authenticate_keep(cfg, secret, None)
     except Exception as e:
         logging.exception(f"Failed to authenticate with Google Keep: {e}")
         return None
 
-def fetch_all_keep_lists(keep: gkeepapi.Keep) -> Dict[str, List[str]]:
+ItemIndex = Dict[str, Dict[str, gkeepapi.node.ListItem]]
+
+def read_list_items(note: gkeepapi.node.List) -> Tuple[List[str], Dict[str, gkeepapi.node.ListItem]]:
+    """Return a list's unchecked item texts and a lowercase text -> ListItem index.
+
+    The first unchecked item wins for each text; a checked item is indexed only
+    when no unchecked one shares its text, so re-checking it still succeeds.
+    """
+    items = []
+    items_by_text = {}
+    for item in note.items:
+        if item.text:
+            text = item.text.strip()
+            if not item.checked:
+                items.append(text)
+            key = text.lower()
+            existing = items_by_text.get(key)
+            if existing is None or (existing.checked and not item.checked):
+                items_by_text[key] = item
+    return items, items_by_text
+
+def publish_keep_lists(lists_data: Dict[str, List[str]]) -> None:
+    """Swap in a new read-only snapshot of list contents.
+
+    Readers grab keep_lists_snapshot without locking, so neither the dict nor its
+    item lists may be modified once published; writers build a new dict instead.
+    """
+    global keep_lists_snapshot, _lists_payload
+    if orjson is not None:
+        body = orjson.dumps(lists_data, option=orjson.OPT_SORT_KEYS)
+    else:
+        body = json.dumps(lists_data, sort_keys=True, separators=(",", ":")).encode()
+    keep_lists_snapshot = MappingProxyType(lists_data)
+    # Pre-serialized /lists body and its ETag, published as one tuple so they always match.
+    _lists_payload = (body, hashlib.md5(body).hexdigest())
+
+ListVersion = Tuple[str, datetime, int, datetime | None]
+
+def list_version(note: gkeepapi.node.List) -> ListVersion:
+    """Fingerprint a list by its title, its own updated time and its items' updated times.
+
+    gkeepapi does not bump the parent List timestamp when an item is checked,
+    edited or synced in from another device, so the children must be included.
+    This reads every item's timestamp, so fingerprinting is O(total items).
+    """
+    children = note.children
+    latest_child = max((child.timestamps.updated for child in children), default=None)
+    return (note.title, note.timestamps.updated, len(children), latest_child)
+
+def update_keep_lists(keep: gkeepapi.Keep) -> int:
+    """Rebuild in-memory entries for lists changed since the last call; returns how many changed.
+
+    Lists whose list_version() matches the previous pass (no change to the list
+    or any of its items) keep their existing entries by reference. Callers must
+    hold keep_lock.
+    """
+    global keep_list_index, keep_item_index, keep_list_versions
+    list_type = gkeepapi.node.List
+    try:
+        notes = [n for n in keep.all() if isinstance(n, list_type)]
+        versions = {n.id: list_version(n) for n in notes}
+    except Exception as e:
+        logging.exception(f"Error while fetching Google Keep lists: {e}")
+        return 0
+
+    # Idle refresh: leave the indexes and the published snapshot untouched.
+    if versions == keep_list_versions:
+        return 0
+
+    previous = keep_lists_snapshot
     lists_data = {}
+    list_index = {}
+    item_index = {}
+    changed = 0
     try:
-        for n in keep.all():
-            if isinstance(n, gkeepapi.node.List):
-                title = (n.title or "").strip()
-                if title:
-                    items = []
-                    for item in n.items:
-                        if getattr(item, "text", None) and not getattr(item, "checked", False):
-                            items.append(item.text.strip())
-                    lists_data[title] = items
+        for n in notes:
+            unchanged = keep_list_versions.get(n.id) == versions[n.id]
+            if not unchanged:
+                # Counted before the title check so a list renamed to "" still registers.
+                changed += 1
+            title = (n.title or "").strip()
+            if not title:
+                continue
+            key = title.lower()
+            if unchanged and title in previous:
+                lists_data[title] = previous[title]
+                item_index[key] = keep_item_index.get(key, {})
+            else:
+                lists_data[title], item_index[key] = read_list_items(n)
+            list_index[key] = n
     except Exception as e:
         logging.exception(f"Error while fetching Google Keep lists: {e}")
-    return lists_data
+        return 0
+
+    changed += len(keep_list_versions.keys() - versions.keys())
+    publish_keep_lists(lists_data)
+    keep_list_index, keep_item_index = list_index, item_index
+    keep_list_versions = versions
+    return changed
 
-def clear_keep_lists(keep: gkeepapi.Keep, sync_list_names: List[str]) -> None:
-    """Delete all items from the specified Google Keep lists."""
+def clear_keep_lists(keep: gkeepapi.Keep, sync_list_names: Sequence[str]) -> List[gkeepapi.node.List]:
+    """Delete all items from the specified Google Keep lists and return the lists that were found."""
+    cleared = []
     for list_name in sync_list_names:
         try:
-            # Find the list
-            target_list = None
-            for n in keep.all():
-                if isinstance(n, gkeepapi.node.List) and (n.title or "").strip().lower() == list_name.lower():
-                    target_list = n
-                    break
+            target_list = keep_list_index.get(list_name.strip().lower())
 
             if target_list:
                 # Delete all items
@@ -77,6 +234,7 @@ def clear_keep_lists(keep: gkeepapi.Keep, sync_list_names: List[str]) -> None:
                 for item in items_to_delete:
                     item.delete()
                     items_deleted += 1
+                cleared.append(target_list)
 
                 if items_deleted > 0:
                     logging.info(f"Deleted {items_deleted} items from Google Keep list '{list_name}'.")
@@ -86,43 +244,72 @@ def clear_keep_lists(keep: gkeepapi.Keep, sync_list_names: List[str]) -> None:
                 logging.warning(f"Google Keep list '{list_name}' not found.")
         except Exception as e:
             logging.exception(f"Error clearing items in Google Keep list '{list_name}': {e}")
+    return cleared
 
-def refresh_lists_job() -> None:
-    global keep, keep_lists
+def flush_keep_state(cfg: Config) -> None:
+    """Exit hook: wait for any in-flight sync so keep.dump() sees a stable node tree."""
+    with keep_lock:
+        save_keep_state(keep, cfg.state_path)
+
+def refresh_lists_job(cfg: Config) -> None:
     try:
-        keep.sync()
-        new_lists = fetch_all_keep_lists(keep)
-        keep_lists = new_lists
-        logging.info(f"Refreshed {len(keep_lists)} lists from Google Keep.")
+        with keep_lock:
+            keep.sync()
+            changed = update_keep_lists(keep)
+            if not changed:
+                # list_version() covers item edits too, so this only skips truly idle refreshes.
+                logging.debug("No Google Keep list or item changes since last refresh; skipping rebuild.")
+                return
+            save_keep_state(keep, cfg.state_path)
+        logging.info(f"Refreshed {changed} of {len(keep_lists_snapshot)} lists from Google Keep.")
     except Exception as e:
         logging.exception(f"Error refreshing Google Keep lists: {e}")
 
+config: Config | None = None
+keep: gkeepapi.Keep | None = None
+keep_lists_snapshot: Mapping[str, List[str]] = MappingProxyType({})
+_lists_payload: Tuple[bytes, str] = (b"{}", hashlib.md5(b"{}").hexdigest())
+keep_list_index: Dict[str, gkeepapi.node.List] = {}
+keep_item_index: ItemIndex = {}
+keep_list_versions: Dict[str, ListVersion] = {}
+# Serializes Keep access and snapshot/index writers; GET handlers read the snapshot lock-free.
+keep_lock = threading.RLock()
+_stop = threading.Event()
+
 app = Flask(__name__)
 
 @app.route('/lists', methods=['GET'])
 def get_lists():
-    return jsonify(keep_lists)
+    body, etag = _lists_payload
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 @app.route('/list/<list_name>', methods=['GET'])
 def get_list(list_name):
-    if list_name in keep_lists:
-        return jsonify({list_name: keep_lists[list_name]})
+    snap = keep_lists_snapshot
+    if list_name in snap:
+        return jsonify({list_name: snap[list_name]})
     else:
         return jsonify({"error": "List not found"}), 404
 
 @app.route('/clear', methods=['POST'])
 def clear_lists():
-    global keep, keep_lists
     try:
-        sync_list_names = parse_sync_list_names(env("SYNC_LIST_NAMES"))
+        sync_list_names = config.sync_list_names
         if not sync_list_names:
             return jsonify({"error": "No lists defined in SYNC_LIST_NAMES environment variable"}), 400
 
-        clear_keep_lists(keep, sync_list_names)
-        keep.sync()
+        with keep_lock:
+            cleared = clear_keep_lists(keep, sync_list_names)
+            keep.sync()
 
-        # Refresh in-memory lists
-        keep_lists = fetch_all_keep_lists(keep)
+            # Update only the cleared lists in memory
+            new_lists = dict(keep_lists_snapshot)
+            for target_list in cleared:
+                new_lists[target_list.title.strip()] = []
+                keep_item_index[target_list.title.strip().lower()] = {}
+            publish_keep_lists(new_lists)
 
         logging.info("Cleared all items in SYNC_LIST_NAMES from Google Keep.")
         return jsonify({"message": f"Cleared all items in lists: {', '.join(sync_list_names)}"})
@@ -132,7 +319,6 @@ def clear_lists():
 
 @app.route('/list/<list_name>/item', methods=['POST'])
 def add_item(list_name):
-    global keep, keep_lists
     data = request.get_json()
     if not data or 'text' not in data:
         return jsonify({"error": "Missing 'text' field in request body"}), 400
@@ -142,22 +328,20 @@ def add_item(list_name):
         return jsonify({"error": "Item text cannot be empty"}), 400
 
     try:
-        # Find the list
-        target_list = None
-        for n in keep.all():
-            if isinstance(n, gkeepapi.node.List) and (n.title or "").strip().lower() == list_name.lower():
-                target_list = n
-                break
+        with keep_lock:
+            target_list = keep_list_index.get(list_name.strip().lower())
 
-        if not target_list:
-            return jsonify({"error": f"List '{list_name}' not found"}), 404
+            if not target_list:
+                return jsonify({"error": f"List '{list_name}' not found"}), 404
 
-        # Add the item
-        target_list.add(item_text, False)  # False means unchecked
-        keep.sync()
+            # Add the item
+            target_list.add(item_text, False)  # False means unchecked
+            keep.sync()
 
-        # Refresh in-memory lists
-        keep_lists = fetch_all_keep_lists(keep)
+            # Update only the affected list in memory, in Keep's sort order
+            new_lists = dict(keep_lists_snapshot)
+            new_lists[target_list.title.strip()], keep_item_index[target_list.title.strip().lower()] = read_list_items(target_list)
+            publish_keep_lists(new_lists)
 
         logging.info(f"Added item '{item_text}' to list '{list_name}'.")
         return jsonify({"message": f"Added item '{item_text}' to list '{list_name}'"})
@@ -167,33 +351,27 @@ def add_item(list_name):
 
 @app.route('/list/<list_name>/item/<item_text>/check', methods=['PUT'])
 def check_item(list_name, item_text):
-    global keep, keep_lists
     try:
-        # Find the list
-        target_list = None
-        for n in keep.all():
-            if isinstance(n, gkeepapi.node.List) and (n.title or "").strip().lower() == list_name.lower():
-                target_list = n
-                break
+        with keep_lock:
+            target_list = keep_list_index.get(list_name.strip().lower())
 
-        if not target_list:
-            return jsonify({"error": f"List '{list_name}' not found"}), 404
+            if not target_list:
+                return jsonify({"error": f"List '{list_name}' not found"}), 404
 
-        # Find and check the item
-        item_found = False
-        for item in target_list.items:
-            if item.text and item.text.strip().lower() == item_text.lower():
-                item.checked = True
-                item_found = True
-                break
+            # Find and check the item
+            list_key = target_list.title.strip().lower()
+            checked_item = keep_item_index.get(list_key, {}).get(item_text.strip().lower())
 
-        if not item_found:
-            return jsonify({"error": f"Item '{item_text}' not found in list '{list_name}'"}), 404
+            if checked_item is None:
+                return jsonify({"error": f"Item '{item_text}' not found in list '{list_name}'"}), 404
 
-        keep.sync()
+            checked_item.checked = True
+            keep.sync()
 
-        # Refresh in-memory lists
-        keep_lists = fetch_all_keep_lists(keep)
+            # Update only the affected list in memory
+            new_lists = dict(keep_lists_snapshot)
+            new_lists[target_list.title.strip()], keep_item_index[list_key] = read_list_items(target_list)
+            publish_keep_lists(new_lists)
 
         logging.info(f"Marked item '{item_text}' as checked in list '{list_name}'.")
         return jsonify({"message": f"Marked item '{item_text}' as checked in list '{list_name}'"})
@@ -202,42 +380,56 @@ def check_item(list_name, item_text):
         return jsonify({"error": "Failed to check item"}), 500
 
 def scheduler_thread():
-    while True:
+    # Sleep until the next job is due (capped at 60s) instead of polling every second.
+    while not _stop.is_set():
+        idle = schedule.idle_seconds()
+        if idle is None:
+            idle = 60
+        if idle > 0:
+            _stop.wait(timeout=min(idle, 60))
+            if _stop.is_set():
+                break
         schedule.run_pending()
-        time.sleep(1)
+
+def handle_sigterm(signum, frame) -> None:
+    _stop.set()
+    # Unwind the main thread so atexit handlers (state cache flush) run promptly.
+    raise SystemExit(0)
 
 def main() -> None:
-    global keep, keep_lists
+    global config, keep
     setup_logging()
+    config = load_config()
 
-    gkeep_email = env("GKEEP_EMAIL")
-    gkeep_password = env("GKEEP_PASSWORD")
-
-    if not gkeep_email:
+    if not config.gkeep_email:
         logging.error("Missing GKEEP_EMAIL.")
         return
-    if not (gkeep_password or env("GKEEP_MASTER_TOKEN")):
+    if not (config.gkeep_password or config.gkeep_master_token):
         logging.error("Missing GKEEP_PASSWORD or GKEEP_MASTER_TOKEN.")
         return
 
-    keep = login_keep(gkeep_email, gkeep_password)
+    keep = login_keep(config)
     if keep is None:
         logging.error("Could not authenticate to Google Keep.")
         return
 
-    keep_lists = fetch_all_keep_lists(keep)
-    logging.info(f"Loaded {len(keep_lists)} lists from Google Keep.")
+    save_keep_state(keep, config.state_path)
+    atexit.register(flush_keep_state, config)
+
+    update_keep_lists(keep)
+    logging.info(f"Loaded {len(keep_lists_snapshot)} lists from Google Keep.")
 
     # Schedule refresh every 3 minutes
-    schedule.every(3).minutes.do(refresh_lists_job)
+    schedule.every(3).minutes.do(refresh_lists_job, config)
     logging.info("Scheduled list refresh every 3 minutes.")
 
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
     # Start scheduler in background thread
     scheduler = threading.Thread(target=scheduler_thread, daemon=True)
     scheduler.start()
 
-    port = int(env("SERVER_PORT", "5000") or "5000")
-    app.run(host='0.0.0.0', port=port, debug=True)
+    serve(app, host='0.0.0.0', port=config.server_port, threads=8)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file